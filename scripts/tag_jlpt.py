@@ -1,16 +1,124 @@
 #!/usr/bin/env python3
 import csv
+import json
+import pickle
 import sqlite3
 import os
 import sys
 from collections import defaultdict
 
+try:
+    import ahocorasick # Optional: pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import pyarrow # Optional: pip install pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
 # --- Configuration ---
 JLPT_LEVELS = ["N5", "N4", "N3", "N2", "N1"] # Process easier levels first
 # Set DEBUG to True to get detailed output for ambiguous cases, meaning checks, and Kanji mismatches
 DEBUG = True
+# Connection tuning for the bulk update. This is a one-off batch job, so
+# durability on power loss is traded for write throughput.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-200000",    # ~200 MB page cache
+    "PRAGMA mmap_size=268435456",   # 256 MB
+]
+# Number of pending row updates buffered before each executemany flush
+UPDATE_BATCH_SIZE = 20000
 # --- End Configuration ---
 
+# Bump whenever build_vocab_map()'s value layout changes, so a stale
+# vocab_map.pkl is rebuilt instead of loaded
+VOCAB_CACHE_VERSION = 2
+
+def clean_vocab_rows(rows):
+    """
+    Strips the (kanji, kana, english) fields, lowercases English and drops
+    rows without English or without both Kanji and Kana. Shared by both CSV
+    parsers so they produce the same vocabulary map.
+    """
+    cleaned = []
+    for kanji, kana, english in rows:
+        kanji, kana, english = kanji.strip(), kana.strip(), english.strip().lower()
+        if (kanji or kana) and english:
+            cleaned.append((kanji, kana, english))
+    return cleaned
+
+
+def read_vocab_csv_arrow(path):
+    """
+    pyarrow implementation of read_vocab_csv(): parses the file with Arrow's
+    CSV reader, then cleans the rows with clean_vocab_rows() like the csv path.
+
+    Returns None when Arrow cannot reproduce the csv module's result for this
+    file, so the caller falls back to it: Arrow rejects empty files, and it
+    can only skip (not truncate) rows with extra fields, which would change
+    the row order that build_vocab_map's first-seen source Kanji depends on.
+    """
+    columns = ['kanji', 'kana', 'english']
+    invalid_rows = []
+    def handle_invalid_row(row):
+        invalid_rows.append(row)
+        return 'skip'
+    try:
+        tbl = pyarrow.csv.read_csv(
+            path,
+            read_options=pyarrow.csv.ReadOptions(column_names=columns),
+            parse_options=pyarrow.csv.ParseOptions(invalid_row_handler=handle_invalid_row),
+            convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in columns})
+        )
+    except pyarrow.ArrowInvalid:
+        return None
+    # Short rows are dropped by both readers; long ones need the csv module
+    if any(row.actual_columns > row.expected_columns for row in invalid_rows):
+        return None
+
+    rows = zip(tbl['kanji'].to_pylist(), tbl['kana'].to_pylist(), tbl['english'].to_pylist())
+    return clean_vocab_rows(rows), tbl.num_rows + len(invalid_rows)
+
+
+def read_vocab_csv(path):
+    """
+    Reads one VocabList CSV into (kanji, kana, english) rows with surrounding
+    whitespace stripped and English lowercased. Rows without English, or
+    without both Kanji and Kana, are dropped.
+
+    Uses pyarrow's CSV reader when pyarrow is installed (see
+    read_vocab_csv_arrow), otherwise the csv module. Both skip a UTF-8 BOM
+    and blank lines.
+
+    Args:
+        path (str): Path to a VocabList.Nx.csv file.
+
+    Returns:
+        tuple: (rows, total_row_count) where rows is an iterable of
+               (kanji, kana, english) string tuples.
+    """
+    if pyarrow is not None:
+        result = read_vocab_csv_arrow(path)
+        if result is not None:
+            return result
+
+    rows = []
+    total_row_count = 0
+    with open(path, encoding="utf-8-sig") as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            total_row_count += 1
+            if len(row) >= 3:
+                rows.append(row[:3])
+    return clean_vocab_rows(rows), total_row_count
+
+
 def build_vocab_map(csv_dir):
     """
     Builds a map from Japanese words (Kanji or Kana) to their JLPT level,
@@ -21,64 +129,54 @@ def build_vocab_map(csv_dir):
         csv_dir (str): Path to the directory containing VocabList.Nx.csv files.
 
     Returns:
-        dict: A map where keys are Japanese words (str) and values are dicts:
-              {'level': str, 'english': set(str), 'source_kanji': str or None}
-              'level' is the highest JLPT level found (e.g., N1 > N5).
-              'english' is a set of all unique English meanings found for that word.
+        tuple: (vocab_map, failed_paths). failed_paths lists the CSV files that
+        exist but could not be read; missing files are only warned about.
+        vocab_map is a dict where keys are Japanese words (str) and values are tuples:
+              (level: str, english: frozenset(str), source_kanji: str or None)
+              'level' is the easiest JLPT level the word appears at (e.g., N5 over N1).
+              'english' is a set of all unique English meanings found for that word,
+              lowercased for the case-insensitive meaning check.
               'source_kanji' is the Kanji from the CSV row that provided the
               final 'level' information, primarily useful when the key is Kana.
     """
-    # Intermediate structure: { japanese_word -> {'levels': set(str), 'english': set(str), 'sources': list} }
-    # 'sources' will store {'level': str, 'kanji': str, 'kana': str} from each contributing row
-    intermediate_vocab = defaultdict(lambda: {'levels': set(), 'english': set(), 'sources': []})
+    # Intermediate structure: { japanese_word -> {'levels': set(str), 'english': set(str), 'level_to_kanji': dict} }
+    # 'level_to_kanji' maps each level to the Kanji (or None) of the first row seen at that level
+    intermediate_vocab = defaultdict(lambda: {'levels': set(), 'english': set(), 'level_to_kanji': {}})
     print("Building vocabulary map...")
     print(f"Processing levels: {', '.join(JLPT_LEVELS)}")
 
     processed_files = 0
+    failed_paths = []
     total_rows_processed = 0
     total_entries_added = 0 # Will count unique keys in the final map
 
     for lvl in JLPT_LEVELS:
         path = os.path.join(csv_dir, f"VocabList.{lvl}.csv")
         print(f"  Processing {path}...")
-        rows_in_file = 0
         entries_from_file = 0 # Counts unique word forms added/updated *from this file*
         try:
-            with open(path, encoding="utf-8") as f:
-                reader = csv.reader(f)
-                for i, row in enumerate(reader):
-                    rows_in_file += 1
-                    if len(row) < 3:
-                        if DEBUG: print(f"    [Debug] Skipping malformed row {i+1} in {lvl}: {row}")
+            rows, rows_in_file = read_vocab_csv(path)
+            # Hot loop: resolve each key's entry once and keep lookups local.
+            # Strings are interned so repeated meanings/forms share one copy.
+            get_entry = intermediate_vocab.__getitem__
+            intern = sys.intern
+            for kanji, kana, english in rows:
+                kanji = intern(kanji)
+                kana = intern(kana)
+                english = intern(english)
+                source_kanji = kanji or None
+                # Key on the Kanji form and, if it differs, on the Kana form too
+                for key in (kanji, kana if kana != kanji else ""):
+                    if not key:
                         continue
-                    kanji = row[0].strip()
-                    kana = row[1].strip()
-                    english = row[2].strip()
-
-                    if not (kanji or kana) or not english:
-                        if DEBUG: print(f"    [Debug] Skipping row {i+1} in {lvl} due to missing key data (Kanji/Kana or English): {row}")
-                        continue # Need at least Kanji or Kana, and English
-
-                    keys = set()
-                    if kanji: keys.add(kanji)
-                    if kana and (kana != kanji or not kanji):
-                        keys.add(kana)
-
-                    if not keys:
-                         if DEBUG: print(f"    [Debug] Skipping row {i+1} in {lvl}, no valid key found: {row}")
-                         continue
-
-                    source_info = {'level': lvl, 'kanji': kanji, 'kana': kana}
-                    added_key_from_row = False
-                    for key in keys:
-                        intermediate_vocab[key]['levels'].add(lvl)
-                        intermediate_vocab[key]['english'].add(english)
-                        intermediate_vocab[key]['sources'].append(source_info)
-                        added_key_from_row = True
-
-                    if added_key_from_row:
-                        entries_from_file += 1
-
+                    entry = get_entry(key)
+                    entry['levels'].add(lvl)
+                    entry['english'].add(english)
+                    entry['level_to_kanji'].setdefault(lvl, source_kanji)
+                entries_from_file += 1
+
+            if DEBUG and rows_in_file != entries_from_file:
+                print(f"    [Debug] Skipped {rows_in_file - entries_from_file} malformed rows or rows missing Kanji/Kana or English in {lvl}.")
             print(f"    Finished {path}. Processed {rows_in_file} rows, potentially added/updated {entries_from_file} unique word forms.")
             processed_files += 1
             total_rows_processed += rows_in_file
@@ -87,29 +185,20 @@ def build_vocab_map(csv_dir):
             print(f"  Warning: CSV file not found at {path}. Skipping.")
         except Exception as e:
             print(f"  Error reading {path}: {e}")
+            failed_paths.append(path)
 
     # --- Resolve Levels and Finalize Map ---
     final_vocab = {}
     level_key_func = lambda level_str: int(level_str[1:]) # N5 -> 5, N1 -> 1
-    level_sort_reverse = True # True means N1 comes before N5 (higher level priority)
 
     for key, data in intermediate_vocab.items():
         if not data['levels']: continue
 
-        sorted_levels = sorted(list(data['levels']), key=level_key_func, reverse=level_sort_reverse)
-        final_level = sorted_levels[0] # Pick the highest priority level
+        final_level = max(data['levels'], key=level_key_func) # Pick the easiest level (N5 wins over N1)
+        final_source_kanji = data['level_to_kanji'].get(final_level)
 
-        final_source_kanji = None
-        for src in data['sources']:
-            if src['level'] == final_level:
-                final_source_kanji = src['kanji'] if src['kanji'] else None
-                break
-
-        final_vocab[key] = {
-            'level': final_level, # Store the level string like "N5"
-            'english': data['english'],
-            'source_kanji': final_source_kanji
-        }
+        # Flat tuple: callers unpack it instead of doing per-field dict lookups
+        final_vocab[key] = (final_level, frozenset(data['english']), final_source_kanji)
         total_entries_added +=1
 
     print("-" * 20)
@@ -117,21 +206,166 @@ def build_vocab_map(csv_dir):
     print(f"  Processed {processed_files} CSV files, {total_rows_processed} total rows.")
     print(f"  Created map with {total_entries_added} unique Japanese word entries.")
     print("-" * 20)
-    return final_vocab
+    return final_vocab, failed_paths
+
 
+def load_vocab_map(csv_dir, cache_path):
+    """
+    Returns the vocabulary map for csv_dir, reusing the pickled copy at
+    cache_path when none of the VocabList CSVs have changed (by mtime and size)
+    since it was written. Otherwise builds it with build_vocab_map() and
+    refreshes the cache, unless some CSV failed to read (a partial map is
+    never cached). The cache key also covers VOCAB_CACHE_VERSION.
+
+    Args:
+        csv_dir (str): Path to the directory containing VocabList.Nx.csv files.
+        cache_path (str): Path of the pickle cache file.
 
-def check_meaning_overlap(db_meaning, csv_english_set):
+    Returns:
+        dict: Same map as build_vocab_map().
+    """
+    cache_key = [VOCAB_CACHE_VERSION]
+    for lvl in JLPT_LEVELS:
+        try:
+            st = os.stat(os.path.join(csv_dir, f"VocabList.{lvl}.csv"))
+            cache_key.append((lvl, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            cache_key.append((lvl, None, None))
+
+    try:
+        with open(cache_path, "rb") as f:
+            cached_key, vocab_map = pickle.load(f)
+        if cached_key == cache_key:
+            print(f"Loaded vocabulary map from cache: {cache_path} ({len(vocab_map)} entries)")
+            return vocab_map
+        print("Vocabulary CSVs changed since the cache was written. Rebuilding...")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"  Warning: Could not read vocabulary cache {cache_path}: {e}. Rebuilding...")
+
+    vocab_map, failed_paths = build_vocab_map(csv_dir)
+    if failed_paths:
+        print(f"  Warning: Not caching the vocabulary map; {len(failed_paths)} CSV file(s) could not be read.")
+    elif vocab_map:
+        try:
+            with open(cache_path, "wb") as f:
+                pickle.dump((cache_key, vocab_map), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            print(f"  Warning: Could not write vocabulary cache {cache_path}: {e}")
+    return vocab_map
+
+
+def build_meaning_automaton(vocab_map):
+    """
+    Compiles every (lowercased) English meaning in the vocabulary map into a
+    single Aho-Corasick automaton, so a database meaning can be scanned once
+    for all of them instead of once per CSV meaning.
+
+    Returns:
+        ahocorasick.Automaton or None: None if pyahocorasick is not installed,
+        in which case check_meaning_overlap() falls back to substring tests.
+    """
+    if ahocorasick is None:
+        print("pyahocorasick not installed; using plain substring meaning checks.")
+        return None
+    automaton = ahocorasick.Automaton()
+    for _, english_set, _ in vocab_map.values():
+        for english in english_set:
+            automaton.add_word(english, english)
+    automaton.make_automaton()
+    return automaton
+
+
+def build_english_initials(vocab_map):
+    """
+    Maps each vocabulary key to the set of first characters of its English
+    meanings. Used as a cheap prefilter by check_meaning_overlap() when no
+    automaton is available: a meaning containing none of these characters
+    cannot contain any of the English strings.
+    """
+    return {key: frozenset(english[0] for english in english_set)
+            for key, (_, english_set, _) in vocab_map.items()}
+
+
+def check_meaning_overlap(db_meaning_lower, csv_english_set, automaton=None, english_initials=None):
     """
     Checks if any of the English definitions from the CSV appear as substrings
-    in the database meaning field. Case-insensitive comparison.
+    in the database meaning field. Case-insensitive comparison: both sides are
+    expected to be lowercased already (the CSV set by build_vocab_map, the
+    meaning once per row by the caller).
+
+    If an automaton from build_meaning_automaton() is given, the meaning is
+    scanned once and each hit is checked against this entry's CSV set.
+    Otherwise, if the entry's english_initials (see build_english_initials)
+    are given and none occur in the meaning, the substring tests are skipped.
     """
-    if not db_meaning or not csv_english_set:
+    if not db_meaning_lower or not csv_english_set:
+        return False
+    if automaton is not None:
+        return any(english in csv_english_set for _, english in automaton.iter(db_meaning_lower))
+    if english_initials is not None and english_initials.isdisjoint(db_meaning_lower):
         return False
-    db_meaning_lower = db_meaning.lower()
-    for csv_eng in csv_english_set:
-        if csv_eng.lower() in db_meaning_lower:
-            return True
-    return False
+    return any(csv_eng in db_meaning_lower for csv_eng in csv_english_set)
+
+
+def load_vocab_table(conn, vocab_map):
+    """
+    Loads the vocabulary map into an indexed temporary table so the Kanji and
+    Kana-only matches can be resolved with set-based UPDATEs inside SQLite
+    instead of one Python round trip per dict_index row.
+
+    The map is shipped as a single JSON parameter and unpacked with json_each,
+    so the whole load is one statement.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the dictionary database.
+        vocab_map (dict): Map returned by build_vocab_map().
+    """
+    print(f"Loading {len(vocab_map)} vocabulary entries into temp.jlpt_vocab...")
+    conn.execute("DROP TABLE IF EXISTS temp.jlpt_vocab")
+    conn.execute("CREATE TEMP TABLE jlpt_vocab (key TEXT PRIMARY KEY, level TEXT NOT NULL, source_kanji TEXT)")
+    vocab_json = json.dumps(
+        [[key, level, source_kanji] for key, (level, _, source_kanji) in vocab_map.items()],
+        ensure_ascii=False
+    )
+    conn.execute("""
+        INSERT INTO temp.jlpt_vocab (key, level, source_kanji)
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+        FROM json_each(?)
+    """, (vocab_json,))
+
+
+def tag_direct_matches(conn, match_sql, match_type, word_column):
+    """
+    Tags every dict_index row that joins to temp.jlpt_vocab on match_sql (an
+    ON condition over the aliases d and v) with the vocab level, using one
+    set-based UPDATE. Rows already at that level are left untouched.
+
+    Args:
+        conn (sqlite3.Connection): Connection with temp.jlpt_vocab loaded.
+        match_sql (str): Join condition selecting this tier's matches.
+        match_type (str): Tier name used in debug output.
+        word_column (str): dict_index column shown as the matched word in debug output.
+
+    Returns:
+        tuple: (matched_count, updated_count)
+    """
+    join_sql = f"FROM dict_index AS d JOIN temp.jlpt_vocab AS v ON {match_sql}"
+    matched_count = conn.execute(f"SELECT count(*) {join_sql}").fetchone()[0]
+    if DEBUG:
+        for rowid, word, db_jlpt_level, lvl in conn.execute(f"SELECT d.rowid, d.{word_column}, d.jlpt_level, v.level {join_sql}"):
+            if db_jlpt_level == lvl:
+                print(f"    [Debug] Rowid={rowid} ({word}): Already has correct jlpt_level '{lvl}'. Skipping update.")
+            else:
+                action = "Setting" if not db_jlpt_level else f"Updating (from '{db_jlpt_level}')"
+                print(f"    [Debug] Rowid={rowid} ({word}): {action} jlpt_level to '{lvl}'. Match type: '{match_type}'.")
+    updated_count = conn.execute(f"""
+        UPDATE dict_index AS d SET jlpt_level = v.level
+        FROM temp.jlpt_vocab AS v
+        WHERE {match_sql} AND d.jlpt_level IS NOT v.level
+    """).rowcount
+    return matched_count, updated_count
 
 
 def main():
@@ -160,132 +394,157 @@ def main():
          sys.exit(1)
 
 
-    vocab_map = build_vocab_map(csv_dir)
+    vocab_map = load_vocab_map(csv_dir, os.path.join(script_dir, "vocab_map.pkl"))
 
     if not vocab_map:
         print("Vocabulary map is empty. Cannot proceed. Check CSV files and paths.")
         sys.exit(1)
 
     conn = None
-    updates = [] # List of tuples: (jlpt_level_value, rowid)
+    original_journal_mode = None # Set once read, so the finally block knows what to restore
+    updates = [] # Pending batch of tuples: (jlpt_level_value, rowid)
+    match_ambiguous_update_count = 0
     processed_count = 0
     match_kanji_count = 0
+    match_kanji_update_count = 0
     match_kana_only_count = 0
+    match_kana_only_update_count = 0
+    match_ambiguous_count = 0
+    match_ambiguous_already_tagged_count = 0
     match_reading_kanji_mismatch_count = 0
     match_ambiguous_meaning_ok_count = 0
     match_ambiguous_meaning_fail_count = 0
-    already_tagged_correctly_count = 0 # Renamed for clarity
-    no_match_count = 0
 
     print(f"Connecting to database: {db_path}")
     try:
-        conn = sqlite3.connect(db_path)
-        c = conn.cursor()
+        # Autocommit mode: the module never opens implicit transactions, so
+        # the explicit BEGIN/COMMIT below is the only transaction boundary.
+        conn = sqlite3.connect(db_path, isolation_level=None)
 
-        print("Fetching entries from dict_index (this may take time)...")
-        # *** Select the new jlpt_level column ***
-        c.execute("SELECT rowid, kanji, reading, meaning, tags, jlpt_level FROM dict_index") # Added jlpt_level
-
-        print("Processing database entries...")
-        for row in c:
-            # *** Unpack the new jlpt_level column ***
-            rowid, db_kanji, db_reading, db_meaning, db_tags, db_jlpt_level = row # Added db_jlpt_level
-            processed_count += 1
-            if processed_count % 20000 == 0:
-                print(f"  Processed {processed_count} entries...")
-
-            lvl = None # This will store the determined level like "N5", "N4" etc.
-            csv_english_set = None
-            match_type = "No Match"
-            vocab_entry = None
-
-            # --- Matching Logic --- (Same as before)
-            if db_kanji and db_kanji in vocab_map:
-                vocab_entry = vocab_map[db_kanji]
-                lvl = vocab_entry['level']
-                csv_english_set = vocab_entry['english']
-                match_type = "Kanji Match"
-                match_kanji_count += 1
-
-            elif not db_kanji and db_reading and db_reading in vocab_map:
-                vocab_entry = vocab_map[db_reading]
-                lvl = vocab_entry['level']
-                csv_english_set = vocab_entry['english']
-                match_type = "Kana-Only DB Entry Match"
-                match_kana_only_count += 1
-
-            elif db_kanji and db_reading and db_reading in vocab_map:
-                potential_vocab_entry = vocab_map[db_reading]
-                potential_lvl = potential_vocab_entry['level']
-                potential_csv_english_set = potential_vocab_entry['english']
-                vocab_source_kanji = potential_vocab_entry.get('source_kanji')
-
-                if db_kanji and vocab_source_kanji and db_kanji != vocab_source_kanji:
-                    match_type = "Mismatch (Reading Match, Different Kanji)"
+        original_journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        c = conn.cursor()
+        cw = conn.cursor() # Writes go through a separate cursor so the SELECT on `c` stays valid
+
+        # Run the whole match-and-update phase as one write transaction
+        conn.execute("BEGIN IMMEDIATE")
+        load_vocab_table(conn, vocab_map)
+
+        # --- Tier 1: Kanji Match (High Confidence) ---
+        print("Tagging Kanji matches...")
+        match_kanji_count, match_kanji_update_count = tag_direct_matches(
+            conn, "v.key = d.kanji", "Kanji Match", "kanji")
+
+        # --- Tier 2: Kana-Only DB Entry Match (Medium Confidence) ---
+        print("Tagging Kana-only matches...")
+        match_kana_only_count, match_kana_only_update_count = tag_direct_matches(
+            conn, "v.key = d.reading AND (d.kanji IS NULL OR d.kanji = '')", "Kana-Only DB Entry Match", "reading")
+
+        # --- Tier 3: Reading Match on Kanji Entry (Ambiguous) ---
+        # Only these rows need the meaning check, which stays in Python because
+        # SQLite's lower() folds ASCII only. Rows already at the right level are
+        # skipped, and the (wide) meaning is only read for rows that will
+        # actually reach the check, not for Kanji mismatches.
+        meaning_automaton = build_meaning_automaton(vocab_map)
+        english_initials = build_english_initials(vocab_map) if meaning_automaton is None else None
+        print("Fetching ambiguous reading matches from dict_index...")
+        match_ambiguous_count, match_ambiguous_already_tagged_count = c.execute("""
+            SELECT count(*), coalesce(sum(d.jlpt_level IS v.level), 0)
+            FROM dict_index AS d
+            JOIN temp.jlpt_vocab AS v ON v.key = d.reading
+            WHERE d.kanji <> ''
+              AND NOT EXISTS (SELECT 1 FROM temp.jlpt_vocab AS vk WHERE vk.key = d.kanji)
+        """).fetchone()
+        c.execute("""
+            SELECT d.rowid, d.kanji, d.reading,
+                   CASE WHEN v.source_kanji IS NULL OR v.source_kanji = d.kanji THEN d.meaning END,
+                   d.jlpt_level, v.level, v.source_kanji
+            FROM dict_index AS d
+            JOIN temp.jlpt_vocab AS v ON v.key = d.reading
+            WHERE d.kanji <> ''
+              AND d.jlpt_level IS NOT v.level
+              AND NOT EXISTS (SELECT 1 FROM temp.jlpt_vocab AS vk WHERE vk.key = d.kanji)
+        """)
+
+        print("Processing ambiguous entries...")
+        debug = DEBUG # Local lookup in the loop below instead of a global one per row
+        c.arraysize = 10000 # Rows pulled per fetchmany() round trip
+        updates_append = updates.append
+        while True:
+            rows = c.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                # Level and source Kanji come from the join, so vocab_map is only
+                # probed (once) for rows that reach the meaning check
+                rowid, db_kanji, db_reading, db_meaning, db_jlpt_level, lvl, vocab_source_kanji = row
+                processed_count += 1
+                if processed_count % 20000 == 0:
+                    print(f"  Processed {processed_count} entries...")
+
+                if vocab_source_kanji and db_kanji != vocab_source_kanji:
                     match_reading_kanji_mismatch_count += 1
-                    if DEBUG:
+                    if debug:
                         print(f"\n  [Debug] Kanji Mismatch on Reading Match for rowid={rowid}: DB='{db_kanji}', CSV Source='{vocab_source_kanji}'. No JLPT level set.")
-                else:
-                    match_type = "Ambiguous (Reading Match on Kanji Entry)"
-                    if DEBUG:
-                         # Shortened debug output slightly
-                         print(f"\n  [Debug] Ambiguous case rowid={rowid}: DB='{db_kanji}' Reading='{db_reading}'. Vocab Key='{db_reading}' Level='{potential_lvl}' SourceKanji='{vocab_source_kanji}'")
-
-                    if check_meaning_overlap(db_meaning, potential_csv_english_set):
-                        vocab_entry = potential_vocab_entry
-                        lvl = potential_lvl # Set level on successful meaning check
-                        csv_english_set = potential_csv_english_set
-                        match_type += " -> Meaning OK"
-                        match_ambiguous_meaning_ok_count += 1
-                        if DEBUG: print("    Meaning Check: PASSED")
-                    else:
-                        match_type += " -> Meaning FAILED"
-                        match_ambiguous_meaning_fail_count += 1
-                        if DEBUG: print("    Meaning Check: FAILED")
-            else:
-                no_match_count += 1
-                match_type = "No Match"
-
-            # --- Tagging Logic (Simplified for dedicated column) ---
-            if lvl: # If a level was determined by any successful match
-                # Check if the jlpt_level column already has the correct value
-                if db_jlpt_level == lvl:
-                    already_tagged_correctly_count += 1
-                    if DEBUG and match_type not in ["No Match", "Mismatch (Reading Match, Different Kanji)", "Ambiguous (Reading Match on Kanji Entry) -> Meaning FAILED"]:
-                         print(f"    [Debug] Rowid={rowid} ({db_kanji or db_reading}): Already has correct jlpt_level '{lvl}'. Skipping update.")
-                else:
-                    # Add update job: (level_value, rowid)
-                    updates.append((lvl, rowid))
-                    if DEBUG:
-                        matched_word = db_kanji if match_type == "Kanji Match" else db_reading
-                        action = "Setting" if not db_jlpt_level else f"Updating (from '{db_jlpt_level}')"
-                        print(f"    [Debug] Rowid={rowid} ({matched_word}): {action} jlpt_level to '{lvl}'. Match type: '{match_type}'.")
+                    continue
+
+                if debug:
+                     # Shortened debug output slightly
+                     print(f"\n  [Debug] Ambiguous case rowid={rowid}: DB='{db_kanji}' Reading='{db_reading}'. Vocab Key='{db_reading}' Level='{lvl}' SourceKanji='{vocab_source_kanji}'")
+
+                db_meaning_lower = db_meaning.lower() if db_meaning else ""
+                _, csv_english_set, _ = vocab_map[db_reading]
+                initials = english_initials[db_reading] if english_initials is not None else None
+                if not check_meaning_overlap(db_meaning_lower, csv_english_set, meaning_automaton, initials):
+                    match_ambiguous_meaning_fail_count += 1
+                    if debug: print("    Meaning Check: FAILED")
+                    continue
+
+                match_ambiguous_meaning_ok_count += 1
+                if debug: print("    Meaning Check: PASSED")
+
+                # Add update job: (level_value, rowid)
+                updates_append((lvl, rowid))
+                if len(updates) >= UPDATE_BATCH_SIZE:
+                    cw.executemany("UPDATE dict_index SET jlpt_level = ? WHERE rowid = ?", updates)
+                    match_ambiguous_update_count += len(updates)
+                    updates.clear()
+                if debug:
+                    action = "Setting" if not db_jlpt_level else f"Updating (from '{db_jlpt_level}')"
+                    print(f"    [Debug] Rowid={rowid} ({db_reading}): {action} jlpt_level to '{lvl}'. Match type: 'Ambiguous (Reading Match on Kanji Entry) -> Meaning OK'.")
+
+        if updates:
+            cw.executemany("UPDATE dict_index SET jlpt_level = ? WHERE rowid = ?", updates)
+            match_ambiguous_update_count += len(updates)
+            updates.clear()
+
+        c.execute("DROP TABLE temp.jlpt_vocab")
+
+        total_count = c.execute("SELECT count(*) FROM dict_index").fetchone()[0]
+        no_match_count = total_count - match_kanji_count - match_kana_only_count - match_ambiguous_count
+        already_tagged_correctly_count = (match_kanji_count - match_kanji_update_count
+                                          + match_kana_only_count - match_kana_only_update_count)
 
         print("-" * 20)
-        print(f"Finished processing {processed_count} database entries.")
+        print(f"Finished processing {total_count} database entries ({processed_count} ambiguous entries checked in Python).")
         print("Matching Summary:")
         print(f"  - Kanji Matches (High Confidence): {match_kanji_count}")
         print(f"  - Kana-Only DB Entry Matches (Medium Confidence): {match_kana_only_count}")
+        print(f"  - Reading Matches w/ Kanji: Already at Vocab Level (Not Re-checked): {match_ambiguous_already_tagged_count}")
         print(f"  - Reading Matches w/ Kanji: Skipped (Kanji Mismatch): {match_reading_kanji_mismatch_count}")
         print(f"  - Reading Matches w/ Kanji: Processed (Meaning Check Passed): {match_ambiguous_meaning_ok_count}")
         print(f"  - Reading Matches w/ Kanji: Processed (Meaning Check Failed): {match_ambiguous_meaning_fail_count}")
         print(f"  - Entries with No Match Found: {no_match_count}")
-        print(f"  - Entries Already Correctly Tagged in jlpt_level: {already_tagged_correctly_count}")
+        print(f"  - Kanji/Kana-Only Matches Already Correctly Tagged in jlpt_level: {already_tagged_correctly_count}")
         print("-" * 20)
-        total_updates_pending = len(updates)
-        print(f"Total entries needing jlpt_level added/updated: {total_updates_pending}")
-        # Sanity check (approximate)
-        potential_updates = match_kanji_count + match_kana_only_count + match_ambiguous_meaning_ok_count
-        print(f"  (For reference: Kanji + KanaOnly + AmbiguousOK = {potential_updates})")
+        total_updates = match_kanji_update_count + match_kana_only_update_count + match_ambiguous_update_count
+        print(f"Total entries with jlpt_level added/updated: {total_updates}")
         print("-" * 20)
 
-
-        if updates:
-            print(f"Applying {len(updates)} updates to the database (setting jlpt_level)...")
-            # *** Update the new jlpt_level column ***
-            c.executemany("UPDATE dict_index SET jlpt_level = ? WHERE rowid = ?", updates)
-            conn.commit()
-            print(f"Successfully committed {len(updates)} updates.")
+        conn.execute("COMMIT")
+        if total_updates:
+            print(f"Successfully committed {total_updates} updates.")
         else:
             print("No entries required updating.")
 
@@ -304,8 +563,19 @@ def main():
         print(f"An unexpected error occurred: {e}")
     finally:
         if conn:
-            conn.close()
-            print("Database connection closed.")
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+                # WAL mode is persistent; if this run switched to it, switch back
+                # (also after errors) so the bundled V6.db asset is left as a
+                # single self-contained file.
+                if original_journal_mode and original_journal_mode.lower() != "wal":
+                    conn.execute(f"PRAGMA journal_mode={original_journal_mode}")
+            except sqlite3.Error as e:
+                print(f"  Warning: Could not restore journal_mode={original_journal_mode}: {e}")
+            finally:
+                conn.close()
+                print("Database connection closed.")
 
 # --- How to Run ---
 # 1. **Add the column:** Run `ALTER TABLE dict_index ADD COLUMN jlpt_level TEXT;`
@@ -314,6 +584,8 @@ def main():
 # 3. Execution: (Same as before - `python tag_jlpt.py`)
 # 4. Debugging: (Same as before)
 # 5. Backup: (Still recommended!)
+# 6. Reruns: the parsed vocabulary is cached in scripts/vocab_map.pkl and reused
+#    until a VocabList CSV changes; delete it to force a re-parse.
 # ---
 
 if __name__ == "__main__":